@@ -1,46 +1,110 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from functools import lru_cache
 from core.llm_client_anthropic import LLMClient
-from db.models import Message, Session, UserStats
+from core.stream_control import stream_control
+from core.stream_events import TextDelta, ToolUse, Usage, encode_event, sse
+from db.models import Message, ModelComparison, Session, UserStats
 from db.engine import engine
+from db.usage_rollup import record_usage
 from sqlmodel import Session as DBSession
+from uuid import uuid4
 import time
 import json
+import asyncio
+import threading
 import logging
+import anyio
 
 # 設置詳細日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def safe_serialize(obj, debug=False):
-    """安全地序列化物件，處理 Anthropic SDK 的特殊物件"""
-    if debug:
-        print(f"Serializing object of type: {type(obj)}")
-        if hasattr(obj, '__dict__'):
-            print(f"Object attributes: {list(obj.__dict__.keys())}")
-    
-    if obj is None:
-        return None
-    elif isinstance(obj, (str, int, float, bool)):
-        return obj
-    elif isinstance(obj, (list, tuple)):
-        return [safe_serialize(item, debug) for item in obj]
-    elif isinstance(obj, dict):
-        return {k: safe_serialize(v, debug) for k, v in obj.items()}
-    elif hasattr(obj, 'model_dump'):
-        # Pydantic 模型
-        return safe_serialize(obj.model_dump(), debug)
-    elif hasattr(obj, '__dict__'):
-        # 其他物件，轉換為字典
-        return safe_serialize(obj.__dict__, debug)
-    else:
-        # 無法序列化的物件，轉為字串
-        return str(obj)
-
 router = APIRouter()
-llm = LLMClient()
+
+@lru_cache(maxsize=1)
+def get_llm() -> LLMClient:
+    """第一次請求時才建立 LLMClient"""
+    return LLMClient()
+
+class UpstreamStream:
+    """包裝 LLMClient.chat_stream，集中累積內容、工具呼叫與 usage
+
+    __next__ 以 lock 保護：client 斷線時 threadpool 可能仍卡在上一個 next()，
+    收尾的 drain() 必須等它結束，且那一筆事件仍會被記錄。
+    """
+    def __init__(self, events):
+        self._events = events
+        self._lock = threading.Lock()
+        self.content = ""
+        self.tool_calls = []
+        self.usage = Usage()
+        self.error = None
+        # 計時從第一次 next() 開始（毫秒由 ttft_ms / latency_ms 換算）
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+
+    @property
+    def ttft_ms(self) -> Optional[int]:
+        if self.started_at is None or self.first_token_at is None:
+            return None
+        return int((self.first_token_at - self.started_at) * 1000)
+
+    @property
+    def latency_ms(self) -> Optional[int]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return int((self.finished_at - self.started_at) * 1000)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+            try:
+                event = next(self._events)
+            except StopIteration:
+                if self.finished_at is None:
+                    self.finished_at = time.perf_counter()
+                raise
+            if isinstance(event, TextDelta):
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                self.content += event.content
+            elif isinstance(event, ToolUse):
+                self.tool_calls.append(event.tool_call())
+            elif isinstance(event, Usage):
+                self.usage = event
+                self.finished_at = time.perf_counter()
+            return event
+
+    def drain(self):
+        """消耗剩餘事件直到 usage；cancel_event 已設定時上游會立即關閉連線"""
+        try:
+            for _ in self:
+                pass
+        except Exception as e:
+            logger.error(f"[CHAT_STREAM] 關閉上游 stream 失敗: {e}")
+
+async def _pump(model: Optional[str], upstream: UpstreamStream, queue: asyncio.Queue):
+    """在 threadpool 逐筆取得上游事件放進 queue，結束時放入 (model, None)
+
+    阻塞中的 next() 無法被取消；讓 response generator 只 await queue.get()，
+    client 斷線時才能立即 cancel_event.set() 中斷上游，而不是等到下一個事件。
+    """
+    try:
+        async for event in iterate_in_threadpool(upstream):
+            await queue.put((model, event))
+    except Exception as e:
+        logger.error(f"[CHAT_STREAM] {model} 上游發生錯誤: {e}")
+        upstream.error = str(e)
+    await queue.put((model, None))
 
 class ChatRequest(BaseModel):
     session_id: str
@@ -48,75 +112,55 @@ class ChatRequest(BaseModel):
     history: Optional[List[dict]] = None
     model: Optional[str] = "claude-sonnet-4-20250514"
 
+# 每個模型的 pump 在整個回應期間佔用一個 threadpool worker（anyio 預設共 40 個），
+# 限制數量，避免單一比較請求佔滿 worker 讓同步 endpoint 與其他 stream 卡住
+MAX_COMPARE_MODELS = 4
+
+class CompareRequest(BaseModel):
+    session_id: str
+    message: str
+    history: Optional[List[dict]] = None
+    models: List[str] = Field(..., min_length=1, max_length=MAX_COMPARE_MODELS)
+
 @router.post("/chat")
 def chat_endpoint(req: ChatRequest):
     logger.info(f"[CHAT] 收到同步請求: session_id={req.session_id}, message='{req.message}'")
     # 同步版本：完整 JSON 回應，用於不支援 streaming 的情況
-    now = int(time.time() * 1000)
+    # 存 user message 並準備完整 session 歷史訊息
+    messages = _store_user_message(req.session_id, req.message, req.history)
     with DBSession(engine) as db:
-        user_msg = Message(
-            session_id=req.session_id,
-            role="user",
-            content=req.message,
-            timestamp_ms=now
-        )
-        db.add(user_msg)
-        db.commit()
-        db.refresh(user_msg)
-
-        # 準備完整 session 歷史訊息
-        if req.history is not None:
-            messages = req.history
-            messages.append({"role": "user", "content": req.message})
-        else:
-            # 從資料庫獲取所有訊息（包括剛剛存儲的用戶訊息）
-            db_msgs = db.query(Message).filter(Message.session_id == req.session_id).order_by(Message.timestamp_ms).all()
-            messages = [{"role": m.role, "content": m.content} for m in db_msgs]
-            # 不需要再次添加用戶訊息，因為已經在資料庫中了
-        
         # 使用同步 chat 方法獲取完整回應
-        llm_resp = llm.chat(messages, model=req.model)
+        llm_resp = get_llm().chat(messages, model=req.model)
 
         # 存 assistant message
+        now = int(time.time() * 1000)
         assistant_msg = Message(
             session_id=req.session_id,
             role="assistant",
             content=llm_resp["content"],
-            timestamp_ms=int(time.time() * 1000),
-            tool_calls_json=str(llm_resp.get("tool_calls", [])),
+            timestamp_ms=now,
+            tool_calls_json=json.dumps(llm_resp.get("tool_calls", [])),
             prompt_tokens=llm_resp.get("prompt_tokens"),
             completion_tokens=llm_resp.get("completion_tokens"),
-            total_tokens=llm_resp.get("total_tokens")
+            total_tokens=llm_resp.get("total_tokens"),
+            cache_creation_input_tokens=llm_resp.get("cache_creation_input_tokens"),
+            cache_read_input_tokens=llm_resp.get("cache_read_input_tokens"),
+            model=req.model,
+            config_version=llm_resp.get("config_version")
         )
         db.add(assistant_msg)
-        db.commit()
-        db.refresh(assistant_msg)
 
-        # Session 累加 token
-        session = db.get(Session, req.session_id)
-        if session:
-            session.prompt_tokens += llm_resp.get("prompt_tokens") or 0
-            session.completion_tokens += llm_resp.get("completion_tokens") or 0
-            session.total_tokens += llm_resp.get("total_tokens") or 0
-            db.add(session)
-            db.commit()
-
-        # UserStats 累加 token
-        user_stats = db.get(UserStats, 1)
-        if not user_stats:
-            user_stats = UserStats(id=1)
-        user_stats.prompt_tokens += llm_resp.get("prompt_tokens") or 0
-        user_stats.completion_tokens += llm_resp.get("completion_tokens") or 0
-        user_stats.total_tokens += llm_resp.get("total_tokens") or 0
-        db.add(user_stats)
-        db.commit()
+        # Session、UserStats 與 usage rollup 累加 token
+        _accumulate_tokens(db, req.session_id, req.model, now, llm_resp)
+        db.refresh(assistant_msg)
 
         return {
             "message": assistant_msg.content,
             "tool_calls": llm_resp.get("tool_calls", []),
             "prompt_tokens": llm_resp.get("prompt_tokens"),
             "completion_tokens": llm_resp.get("completion_tokens"),
-            "total_tokens": llm_resp.get("total_tokens")
+            "total_tokens": llm_resp.get("total_tokens"),
+            "config_version": llm_resp.get("config_version")
         }
 
 @router.post("/chat/stream")
@@ -124,143 +168,318 @@ async def chat_stream_endpoint(req: ChatRequest):
     logger.info(f"[CHAT_STREAM] 收到 streaming 請求: session_id={req.session_id}, message='{req.message}'")
     # Streaming 版本：SSE + JSON，用於支援 streaming UI
     
-    # 1. 先存 user message
-    now = int(time.time() * 1000)
-    with DBSession(engine) as db:
-        user_msg = Message(
-            session_id=req.session_id,
-            role="user",
-            content=req.message,
-            timestamp_ms=now
-        )
-        db.add(user_msg)
-        db.commit()
-        db.refresh(user_msg)
-
-        # 2. 準備歷史訊息
-        if req.history is not None:
-            messages = req.history
-            messages.append({"role": "user", "content": req.message})
-        else:
-            # 從資料庫獲取所有訊息（包括剛剛存儲的用戶訊息）
-            db_msgs = db.query(Message).filter(Message.session_id == req.session_id).order_by(Message.timestamp_ms).all()
-            messages = [{"role": m.role, "content": m.content} for m in db_msgs]
-            # 不需要再次添加用戶訊息，因為已經在資料庫中了
+    # 1. 先存 user message，2. 準備歷史訊息
+    messages = _store_user_message(req.session_id, req.message, req.history)
 
     # 3. Streaming 回應 + 同時收集完整內容用於存儲
-    def event_stream():
-        collected_content = ""
-        collected_tokens = {"prompt": 0, "completion": 0, "total": 0}
-        assistant_msg_id = None
-        tool_calls = []
-        
-        # 發送開始事件
-        yield f"data: {json.dumps({'type': 'start', 'session_id': req.session_id})}\n\n"
+    async def event_stream():
+        # 在 generator 內才登記：client 在 body 開始前就離開時不會留下登記
+        cancel_event = stream_control.register(req.session_id)
+        upstream = UpstreamStream(get_llm().chat_stream(messages, model=req.model, cancel_event=cancel_event))
+        queue = asyncio.Queue()
+        task = None
+        cancel_reason = None
         
         try:
-            # 流式獲取回應（支援 MCP 事件）
-            for event in llm.chat_stream(messages, model=req.model):
-                if event["type"] == "text":
-                    collected_content += event["content"]
-                    chunk_data = {
-                        "type": "chunk",
-                        "content": event["content"],
-                        "session_id": req.session_id
-                    }
-                    yield f"data: {json.dumps(chunk_data)}\n\n"
-                    
-                elif event["type"] == "mcp_tool_use":
-                    # 使用 safe_serialize 處理可能的 BetaTextBlock 物件
-                    tool_call_data = {
-                        "type": "tool_use",
-                        "name": safe_serialize(event.get("name", "")),
-                        "server_name": safe_serialize(event.get("server_name", "")),
-                        "input": safe_serialize(event.get("input", {})),
-                        "session_id": req.session_id
-                    }
-                    
-                    tool_calls.append({
-                        "name": safe_serialize(event.get("name", "")),
-                        "input": safe_serialize(event.get("input", {}))
-                    })
-                    yield f"data: {json.dumps(tool_call_data)}\n\n"
-                    
-                elif event["type"] == "mcp_tool_result":
-                    tool_result_data = {
-                        "type": "tool_result",
-                        "content": safe_serialize(event.get("content", "")),
-                        "is_error": bool(event.get("is_error", False)),
-                        "session_id": req.session_id
-                    }
-                    yield f"data: {json.dumps(tool_result_data)}\n\n"
-            
-            # Token 估算（MCP 調用可能影響 token 消耗）
-            collected_tokens = {
-                "prompt": len(' '.join([m.get('content', '') for m in messages])) // 4,  # 粗略估算
-                "completion": len(collected_content) // 4,  # 粗略估算
-                "total": 0
-            }
-            collected_tokens["total"] = collected_tokens["prompt"] + collected_tokens["completion"]
+            # 發送開始事件
+            yield sse({'type': 'start', 'session_id': req.session_id})
+
+            # 流式獲取回應（支援 MCP 事件）；上游是同步 generator，由 pump 在 threadpool 逐筆取得，
+            # 這裡只 await queue，client 斷線時可以立即取消，不必等上游下一個事件
+            task = asyncio.create_task(_pump(req.model, upstream, queue))
+            while True:
+                _, event = await queue.get()
+                if event is None:
+                    break
+                # Usage 只用於存檔，不送給前端
+                if not isinstance(event, Usage):
+                    yield encode_event(event, session_id=req.session_id)
+            if upstream.error:
+                raise RuntimeError(upstream.error)
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client 斷線：Starlette 取消 response task 或關閉 generator
+            logger.info(f"[CHAT_STREAM] client 斷線，取消上游 stream: session_id={req.session_id}")
+            cancel_event.set()
+            # 在 shield 內讓上游離開 stream context 並取得實際 usage，接著照常存檔
+            with anyio.CancelScope(shield=True):
+                if task is not None:
+                    task.cancel()
+                await run_in_threadpool(upstream.drain)
+                # 斷線時回應可能早已完整生成，以上游實際的 usage 判斷是否算取消
+                cancel_reason = "disconnect" if upstream.usage.cancelled else None
+                await run_in_threadpool(_finish_stream, req.session_id, req.model, upstream, cancel_reason)
+            raise
         except Exception as e:
             import traceback
             print(f"ERROR in event_stream: {str(e)}")
             print(f"Traceback: {traceback.format_exc()}")
             error_data = {"type": "error", "message": str(e)}
-            yield f"data: {json.dumps(error_data)}\n\n"
-            return
-        
-        # 4. 存儲完整的 assistant message 到資料庫
-        with DBSession(engine) as db:
-            # 使用 safe_serialize 處理 tool_calls
-            safe_tool_calls = safe_serialize(tool_calls) if tool_calls else []
-            tool_calls_json = json.dumps(safe_tool_calls)
+            yield sse(error_data)
+        else:
+            if upstream.usage.cancelled:
+                cancel_reason = "user"
             
+            # 4. 存儲完整的 assistant message 到資料庫
+            assistant_msg_id, collected_tokens = await run_in_threadpool(
+                _finish_stream, req.session_id, req.model, upstream, cancel_reason
+            )
+
+            # 5. 發送結束事件，包含完整 metadata
+            end_data = {
+                "type": "cancelled" if cancel_reason else "end",
+                "session_id": req.session_id,
+                "message_id": assistant_msg_id,
+                "prompt_tokens": collected_tokens["prompt"],
+                "completion_tokens": collected_tokens["completion"],
+                "total_tokens": collected_tokens["total"],
+                "config_version": upstream.usage.config_version
+            }
+            yield sse(end_data)
+        finally:
+            # 不論正常結束、錯誤或斷線都要移除登記，避免 active_streams 殘留
+            stream_control.unregister(req.session_id, cancel_event)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@router.post("/chat/stream/{session_id}/cancel")
+def cancel_stream_endpoint(session_id: str):
+    logger.info(f"[CHAT_STREAM] 收到取消請求: session_id={session_id}")
+    if not stream_control.cancel(session_id):
+        raise HTTPException(status_code=404, detail="No active stream for this session")
+    return {"ok": True, "session_id": session_id}
+
+@router.get("/chat/stream/metrics")
+def stream_metrics_endpoint():
+    return stream_control.metrics()
+
+@router.post("/chat/compare")
+async def chat_compare_endpoint(req: CompareRequest):
+    logger.info(f"[CHAT_COMPARE] 收到比較請求: session_id={req.session_id}, models={req.models}")
+    # 同一則 prompt 同時送給多個模型，delta 交錯輸出在同一條 SSE，以 model 欄位區分
+    models = list(dict.fromkeys(req.models))
+
+    # 歷史只載入一次，所有模型共用；比較用的 prompt 不寫入對話歷史，
+    # 否則下一輪 /chat/stream 會讀到一則沒有回覆的 user 訊息
+    messages = _load_history(req.session_id, req.message, req.history)
+    run_id = str(uuid4())
+
+    async def event_stream():
+        # 在 generator 內才登記：client 在 body 開始前就離開時不會留下登記
+        cancel_event = stream_control.register(req.session_id)
+        upstreams = {
+            model: UpstreamStream(get_llm().chat_stream(messages, model=model, cancel_event=cancel_event))
+            for model in models
+        }
+        queue = asyncio.Queue()
+        tasks = []
+        try:
+            yield sse({'type': 'start', 'session_id': req.session_id, 'models': models})
+            tasks = [asyncio.create_task(_pump(model, upstream, queue)) for model, upstream in upstreams.items()]
+
+            pending = len(tasks)
+            while pending:
+                model, event = await queue.get()
+                if event is None:
+                    pending -= 1
+                    upstream = upstreams[model]
+                    model_end_data = {
+                        "type": "error" if upstream.error else "model_end",
+                        "model": model,
+                        "session_id": req.session_id,
+                        "ttft_ms": upstream.ttft_ms,
+                        "latency_ms": upstream.latency_ms,
+                        "prompt_tokens": upstream.usage.prompt_tokens,
+                        "completion_tokens": upstream.usage.completion_tokens,
+                        "total_tokens": upstream.usage.total_tokens
+                    }
+                    if upstream.error:
+                        model_end_data["message"] = upstream.error
+                    yield sse(model_end_data)
+                elif not isinstance(event, Usage):
+                    yield encode_event(event, model=model, session_id=req.session_id)
+
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.info(f"[CHAT_COMPARE] client 斷線，取消所有上游 stream: session_id={req.session_id}")
+            cancel_event.set()
+            with anyio.CancelScope(shield=True):
+                for task in tasks:
+                    task.cancel()
+                for upstream in upstreams.values():
+                    await run_in_threadpool(upstream.drain)
+                await run_in_threadpool(_finish_compare, req.session_id, run_id, req.message, upstreams, "disconnect")
+            raise
+        else:
+            cancel_reason = "user" if cancel_event.is_set() else None
+            results = await run_in_threadpool(_finish_compare, req.session_id, run_id, req.message, upstreams, cancel_reason)
+
+            end_data = {
+                "type": "cancelled" if cancel_reason else "end",
+                "session_id": req.session_id,
+                "run_id": run_id,
+                "results": results
+            }
+            yield sse(end_data)
+        finally:
+            # 不論正常結束、錯誤或斷線都要移除登記，避免 active_streams 殘留
+            stream_control.unregister(req.session_id, cancel_event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@router.get("/chat/compare/{session_id}")
+def list_comparisons(session_id: str):
+    with DBSession(engine) as db:
+        rows = db.query(ModelComparison).filter(ModelComparison.session_id == session_id).order_by(ModelComparison.timestamp_ms).all()
+        return {"data": rows}
+
+def _load_history(session_id: str, message: str, history: Optional[List[dict]]) -> List[dict]:
+    """準備送給模型的對話：history 或資料庫中的訊息，最後接上這次的 prompt（不存檔）"""
+    if history is not None:
+        return history + [{"role": "user", "content": message}]
+    with DBSession(engine) as db:
+        db_msgs = db.query(Message).filter(Message.session_id == session_id).order_by(Message.timestamp_ms).all()
+        # 略過空的 assistant 訊息（舊版會存下在第一個 token 前就取消的回應），Anthropic 不接受
+        messages = [{"role": m.role, "content": m.content} for m in db_msgs if m.role != "assistant" or m.content]
+    messages.append({"role": "user", "content": message})
+    return messages
+
+def _store_user_message(session_id: str, message: str, history: Optional[List[dict]]) -> List[dict]:
+    """存 user message 並回傳送給模型的對話（與 _load_history 相同）"""
+    # 先讀歷史再存檔，_load_history 會自行接上這次的 prompt
+    messages = _load_history(session_id, message, history)
+    with DBSession(engine) as db:
+        db.add(Message(
+            session_id=session_id,
+            role="user",
+            content=message,
+            timestamp_ms=int(time.time() * 1000)
+        ))
+        db.commit()
+    return messages
+
+def _accumulate_tokens(db: DBSession, session_id: str, model: Optional[str], timestamp_ms: int, usage: dict,
+                       message_count: int = 1):
+    """累加 session、user stats 與 usage rollup 的 token，並 commit"""
+    collected_tokens = _collected_tokens(usage)
+    session = db.get(Session, session_id)
+    if session:
+        session.prompt_tokens += collected_tokens["prompt"]
+        session.completion_tokens += collected_tokens["completion"] 
+        session.total_tokens += collected_tokens["total"]
+        db.add(session)
+
+    user_stats = db.get(UserStats, 1)
+    if not user_stats:
+        user_stats = UserStats(id=1)
+    user_stats.prompt_tokens += collected_tokens["prompt"]
+    user_stats.completion_tokens += collected_tokens["completion"]
+    user_stats.total_tokens += collected_tokens["total"]
+    db.add(user_stats)
+
+    record_usage(db, session_id, model, timestamp_ms, usage, message_count)
+    db.commit()
+
+def _collected_tokens(usage: dict) -> dict:
+    return {
+        "prompt": usage.get("prompt_tokens") or 0,
+        "completion": usage.get("completion_tokens") or 0,
+        "total": usage.get("total_tokens") or 0
+    }
+
+def _finish_compare(session_id: str, run_id: str, prompt: str, upstreams: dict, cancel_reason: Optional[str]) -> list:
+    """每個模型存一筆 ModelComparison（不寫入對話歷史），並累加 token"""
+    results = []
+    now = int(time.time() * 1000)
+    with DBSession(engine) as db:
+        for model, upstream in upstreams.items():
+            usage = upstream.usage.to_dict()
+            collected_tokens = _collected_tokens(usage)
+            if upstream.error:
+                status = "error"
+            elif upstream.usage.cancelled:
+                status = "cancelled"
+            else:
+                status = "completed"
+            row = ModelComparison(
+                session_id=session_id,
+                run_id=run_id,
+                prompt=prompt,
+                model=model,
+                content=upstream.content,
+                timestamp_ms=now,
+                ttft_ms=upstream.ttft_ms,
+                latency_ms=upstream.latency_ms,
+                prompt_tokens=collected_tokens["prompt"],
+                completion_tokens=collected_tokens["completion"],
+                total_tokens=collected_tokens["total"],
+                cache_creation_input_tokens=upstream.usage.cache_creation_input_tokens,
+                cache_read_input_tokens=upstream.usage.cache_read_input_tokens,
+                status=status,
+                config_version=upstream.usage.config_version
+            )
+            db.add(row)
+            _accumulate_tokens(db, session_id, model, now, usage)
+            db.refresh(row)
+            results.append({
+                "id": row.id,
+                "model": model,
+                "status": status,
+                "ttft_ms": row.ttft_ms,
+                "latency_ms": row.latency_ms,
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "total_tokens": row.total_tokens,
+                "config_version": row.config_version
+            })
+            if status == "cancelled":
+                stream_control.record_cancellation(
+                    cancel_reason or "user", collected_tokens["completion"], upstream.usage.max_tokens or get_llm().max_tokens
+                )
+    return results
+
+def _finish_stream(session_id: str, model: Optional[str], upstream: "UpstreamStream", cancel_reason: Optional[str]):
+    """存 assistant message、累加 token，取消時記錄節省的 token
+
+    在第一個 token 前就取消的回應沒有內容，不存成 Message（Anthropic 不接受空的 assistant 訊息，
+    之後每一輪都會失敗），但 prompt token 仍照常累加；回傳的 message id 為 None。
+    """
+    usage = upstream.usage.to_dict()
+    collected_tokens = _collected_tokens(usage)
+    now = int(time.time() * 1000)
+    assistant_msg_id = None
+    with DBSession(engine) as db:
+        if cancel_reason and not upstream.content:
+            _accumulate_tokens(db, session_id, model, now, usage, message_count=0)
+        else:
+            # ToolUse 建立時已轉成 JSON 相容的值
+            tool_calls_json = json.dumps(upstream.tool_calls)
+
             assistant_msg = Message(
-                session_id=req.session_id,
+                session_id=session_id,
                 role="assistant", 
-                content=collected_content,
-                timestamp_ms=int(time.time() * 1000),
+                content=upstream.content,
+                timestamp_ms=now,
                 tool_calls_json=tool_calls_json,
                 prompt_tokens=collected_tokens["prompt"],
                 completion_tokens=collected_tokens["completion"],
-                total_tokens=collected_tokens["total"]
+                total_tokens=collected_tokens["total"],
+                cache_creation_input_tokens=usage.get("cache_creation_input_tokens"),
+                cache_read_input_tokens=usage.get("cache_read_input_tokens"),
+                model=model,
+                status="cancelled" if cancel_reason else "completed",
+                config_version=usage.get("config_version")
             )
             db.add(assistant_msg)
-            db.commit()
+
+            # 更新 session tokens、user stats 與 usage rollup（與訊息同一個 commit）
+            _accumulate_tokens(db, session_id, model, now, usage)
             db.refresh(assistant_msg)
-            
+
             # 在 session 內取得 ID，避免 DetachedInstanceError
             assistant_msg_id = assistant_msg.id
 
-            # 更新 session tokens
-            session = db.get(Session, req.session_id)
-            if session:
-                session.prompt_tokens += collected_tokens["prompt"]
-                session.completion_tokens += collected_tokens["completion"] 
-                session.total_tokens += collected_tokens["total"]
-                db.add(session)
-                db.commit()
-
-            # 更新 user stats
-            user_stats = db.get(UserStats, 1)
-            if not user_stats:
-                user_stats = UserStats(id=1)
-            user_stats.prompt_tokens += collected_tokens["prompt"]
-            user_stats.completion_tokens += collected_tokens["completion"]
-            user_stats.total_tokens += collected_tokens["total"]
-            db.add(user_stats)
-            db.commit()
-
-        # 5. 發送結束事件，包含完整 metadata
-        end_data = {
-            "type": "end",
-            "session_id": req.session_id,
-            "message_id": assistant_msg_id,
-            "prompt_tokens": collected_tokens["prompt"],
-            "completion_tokens": collected_tokens["completion"],
-            "total_tokens": collected_tokens["total"]
-        }
-        yield f"data: {json.dumps(end_data)}\n\n"
-    
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    if cancel_reason:
+        stream_control.record_cancellation(
+            cancel_reason, collected_tokens["completion"], usage.get("max_tokens") or get_llm().max_tokens
+        )
+    return assistant_msg_id, collected_tokens
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException
+from config import config_registry
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+def _describe(snapshot):
+    # 不回傳 authorization_token 等敏感欄位
+    return {
+        "version": snapshot.version,
+        "loaded_at": snapshot.loaded_at,
+        "system_prompt_chars": len(snapshot.system_prompt),
+        "mcp_servers": [s.get("name") for s in snapshot.mcp_servers]
+    }
+
+@router.get("/config")
+def get_config():
+    return _describe(config_registry.snapshot())
+
+@router.post("/config/reload")
+def reload_config():
+    try:
+        snapshot = config_registry.reload()
+    except Exception as e:
+        logger.error(f"[CONFIG] reload 失敗: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return _describe(snapshot)
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException
+from sqlmodel import Session as DBSession, select, func
+from db.models import UsageRollup, UserStats
+from db.engine import engine
+from typing import Optional
+import datetime
+
+router = APIRouter()
+
+GROUP_COLUMNS = {
+    "day": [UsageRollup.day],
+    "model": [UsageRollup.model],
+    "session": [UsageRollup.session_id],
+    "day_model": [UsageRollup.day, UsageRollup.model],
+    "total": [],
+}
+
+SUM_COLUMNS = [
+    "message_count",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+]
+
+def _parse_day(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+
+@router.get("/stats")
+def get_stats(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    group_by: str = "day",
+    model: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """查詢 UsageRollup，start / end 為 UTC 日期（含），只掃描範圍內的 bucket，不讀 Message"""
+    if group_by not in GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {list(GROUP_COLUMNS)}")
+    start = _parse_day(start, "start")
+    end = _parse_day(end, "end")
+
+    group_columns = GROUP_COLUMNS[group_by]
+    sums = [func.coalesce(func.sum(getattr(UsageRollup, name)), 0).label(name) for name in SUM_COLUMNS]
+    stmt = select(*group_columns, *sums)
+    if start:
+        stmt = stmt.where(UsageRollup.day >= start)
+    if end:
+        stmt = stmt.where(UsageRollup.day <= end)
+    if model:
+        stmt = stmt.where(UsageRollup.model == model)
+    if session_id:
+        stmt = stmt.where(UsageRollup.session_id == session_id)
+    if group_columns:
+        stmt = stmt.group_by(*group_columns).order_by(*group_columns)
+
+    with DBSession(engine) as db:
+        rows = db.exec(stmt).all()
+    return {
+        "start": start,
+        "end": end,
+        "group_by": group_by,
+        "data": [dict(row._mapping) for row in rows]
+    }
+
+@router.get("/stats/totals")
+def get_totals():
+    """累計用量（含已刪除 session 的部分）"""
+    with DBSession(engine) as db:
+        user_stats = db.get(UserStats, 1) or UserStats(id=1)
+        return {"data": user_stats.dict()}
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Stream 事件序列化 micro-benchmark
+
+比較舊流程（safe_serialize 在 LLMClient 與 api/chat.py 各跑一次、tool_calls 再跑一次，
+dict 事件再 json.dumps）與 core.stream_events（建立事件時轉換一次、encode_event 一次）
+在大量 MCP 工具呼叫的 stream 上，每個事件花費的 CPU 時間。
+
+用法：python bench_stream_events.py [rounds]
+"""
+import json
+import sys
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from core.stream_events import TextDelta, ToolUse, ToolResult, encode_event
+
+# 模擬 Anthropic SDK 的 block 物件
+class FakeTextBlock(BaseModel):
+    type: str = "text"
+    text: str
+
+class FakeToolUseBlock(BaseModel):
+    type: str = "mcp_tool_use"
+    id: str
+    name: str
+    server_name: str
+    input: dict
+
+class FakeToolResultBlock(BaseModel):
+    type: str = "mcp_tool_result"
+    tool_use_id: str
+    is_error: bool = False
+    content: List[FakeTextBlock]
+    meta: Optional[dict] = None
+
+def legacy_safe_serialize(obj, debug=False):
+    """基準：原本複製在 api/chat.py 與 core/llm_client_anthropic.py 的 safe_serialize"""
+    if debug:
+        print(f"Serializing object of type: {type(obj)}")
+    if obj is None:
+        return None
+    elif isinstance(obj, (str, int, float, bool)):
+        return obj
+    elif isinstance(obj, (list, tuple)):
+        return [legacy_safe_serialize(item, debug) for item in obj]
+    elif isinstance(obj, dict):
+        return {k: legacy_safe_serialize(v, debug) for k, v in obj.items()}
+    elif hasattr(obj, 'model_dump'):
+        return legacy_safe_serialize(obj.model_dump(), debug)
+    elif hasattr(obj, '__dict__'):
+        return legacy_safe_serialize(obj.__dict__, debug)
+    else:
+        return str(obj)
+
+def build_blocks(tool_calls: int = 8, text_deltas: int = 200):
+    """一個 tool-heavy 回合：每次工具呼叫都帶有巢狀 input 與多段結果"""
+    blocks = []
+    for i in range(tool_calls):
+        blocks.append(("tool_use", FakeToolUseBlock(
+            id=f"toolu_{i}",
+            name="list_gcal_events",
+            server_name="google_calendar",
+            input={
+                "calendar_id": "primary",
+                "time_min": "2025-01-01T00:00:00Z",
+                "time_max": "2025-01-31T23:59:59Z",
+                "filters": [{"field": "attendee", "values": [f"user{j}@example.com" for j in range(10)]}],
+                "options": {"max_results": 50, "single_events": True, "order_by": "startTime"},
+            }
+        )))
+        blocks.append(("tool_result", FakeToolResultBlock(
+            tool_use_id=f"toolu_{i}",
+            content=[FakeTextBlock(text=f"event {j}: meeting with team {j}") for j in range(20)],
+        )))
+    for i in range(text_deltas):
+        blocks.append(("text", f"token{i} "))
+    return blocks
+
+def run_legacy(blocks, session_id: str) -> int:
+    tool_calls = []
+    size = 0
+    for kind, block in blocks:
+        if kind == "text":
+            event = {"type": "text", "content": block}
+            size += len(f"data: {json.dumps({'type': 'chunk', 'content': event['content'], 'session_id': session_id})}\n\n")
+        elif kind == "tool_use":
+            # LLMClient.chat_stream
+            event = {
+                "type": "mcp_tool_use",
+                "name": legacy_safe_serialize(getattr(block, 'name', '')),
+                "server_name": legacy_safe_serialize(getattr(block, 'server_name', '')),
+                "input": legacy_safe_serialize(getattr(block, 'input', {})),
+            }
+            # api/chat.py event_stream
+            tool_call_data = {
+                "type": "tool_use",
+                "name": legacy_safe_serialize(event.get("name", "")),
+                "server_name": legacy_safe_serialize(event.get("server_name", "")),
+                "input": legacy_safe_serialize(event.get("input", {})),
+                "session_id": session_id,
+            }
+            tool_calls.append({
+                "name": legacy_safe_serialize(event.get("name", "")),
+                "input": legacy_safe_serialize(event.get("input", {})),
+            })
+            size += len(f"data: {json.dumps(tool_call_data)}\n\n")
+        else:
+            processed_content = ""
+            for item in block.content:
+                processed_content += str(item.text)
+            event = {"type": "mcp_tool_result", "content": processed_content, "is_error": block.is_error}
+            tool_result_data = {
+                "type": "tool_result",
+                "content": legacy_safe_serialize(event.get("content", "")),
+                "is_error": bool(event.get("is_error", False)),
+                "session_id": session_id,
+            }
+            size += len(f"data: {json.dumps(tool_result_data)}\n\n")
+    size += len(json.dumps(legacy_safe_serialize(tool_calls)))
+    return size
+
+def run_typed(blocks, session_id: str) -> int:
+    tool_calls = []
+    size = 0
+    for kind, block in blocks:
+        if kind == "text":
+            event = TextDelta(block)
+        elif kind == "tool_use":
+            event = ToolUse(
+                getattr(block, 'name', ''),
+                getattr(block, 'server_name', ''),
+                getattr(block, 'input', {}),
+            )
+            tool_calls.append(event.tool_call())
+        else:
+            processed_content = ""
+            for item in block.content:
+                processed_content += str(item.text)
+            event = ToolResult(processed_content, block.is_error)
+        size += len(encode_event(event, session_id=session_id))
+    size += len(json.dumps(tool_calls))
+    return size
+
+def bench(fn, blocks, rounds: int) -> float:
+    fn(blocks, "warmup")
+    start = time.process_time()
+    for _ in range(rounds):
+        fn(blocks, "bench-session")
+    elapsed = time.process_time() - start
+    return elapsed / (rounds * len(blocks)) * 1e6
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for tool_calls, text_deltas in ((8, 200), (32, 50)):
+        blocks = build_blocks(tool_calls, text_deltas)
+        tool_blocks = [b for b in blocks if b[0] != "text"]
+        print(f"stream: {tool_calls} tool calls, {text_deltas} text deltas ({len(blocks)} events)")
+        for label, events in (("all events", blocks), ("tool events only", tool_blocks)):
+            legacy = bench(run_legacy, events, rounds)
+            typed = bench(run_typed, events, rounds)
+            print(f"  {label:17s} legacy {legacy:7.2f} us/event   typed {typed:7.2f} us/event   x{legacy / typed:.2f}")
+
+if __name__ == "__main__":
+    main()
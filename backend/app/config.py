@@ -1,8 +1,196 @@
-from dotenv import load_dotenv
+from typing import NamedTuple
+import hashlib
+import threading
+import logging
+import json
+import time
 import os
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "你是一個高效的 AI 助理，請用繁體中文回覆。")
-OPENAI_KEY = os.getenv("OPENAI_KEY", "")
-MCP_BASE_URL = os.getenv("MCP_BASE_URL", "")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG_POLL_INTERVAL = 2.0
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+def _ensure_env():
+    """第一次讀取設定時才載入 .env，避免 import 時的 I/O"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+def get_env(name: str, default: str = "") -> str:
+    _ensure_env()
+    return os.getenv(name, default)
+
+class Settings:
+    """環境變數設定的單一入口；每次存取都讀 os.environ，不在 import 時固定值"""
+
+    @property
+    def anthropic_api_key(self) -> str:
+        return get_env("ANTHROPIC_API_KEY", "")
+
+    @property
+    def openai_key(self) -> str:
+        return get_env("OPENAI_KEY", "")
+
+    @property
+    def mcp_base_url(self) -> str:
+        return get_env("MCP_BASE_URL", "")
+
+    @property
+    def default_system_prompt(self) -> str:
+        return get_env("SYSTEM_PROMPT", "你是一個高效的 AI 助理，請用繁體中文回覆。")
+
+    @property
+    def system_prompt_path(self) -> str:
+        return get_env("SYSTEM_PROMPT_PATH", os.path.join(BASE_DIR, "core", "system_prompt.md"))
+
+    @property
+    def mcp_servers_path(self) -> str:
+        return get_env("MCP_SERVERS_PATH", os.path.join(BASE_DIR, "core", "mcp_servers.json"))
+
+    @property
+    def config_poll_interval(self) -> float:
+        value = get_env("CONFIG_POLL_INTERVAL", "")
+        if not value:
+            return DEFAULT_CONFIG_POLL_INTERVAL
+        try:
+            return float(value)
+        except ValueError:
+            logger.warning(f"[CONFIG] CONFIG_POLL_INTERVAL={value!r} 不是數字，使用預設值 {DEFAULT_CONFIG_POLL_INTERVAL}")
+            return DEFAULT_CONFIG_POLL_INTERVAL
+
+    @property
+    def docker_env(self) -> bool:
+        return bool(get_env("DOCKER_ENV", ""))
+
+    @property
+    def database_url(self) -> str:
+        url = get_env("DATABASE_URL", "")
+        if url:
+            return url
+        if self.docker_env:
+            # Docker 環境，使用 volume 路徑
+            return "sqlite:////app/db/db.sqlite3"
+        # 本地開發環境
+        return f"sqlite:///{os.path.join(BASE_DIR, 'db', 'db.sqlite3')}"
+
+settings = Settings()
+
+class ConfigSnapshot(NamedTuple):
+    """某一版本的 prompt 與 MCP 設定；不可變，進行中的 stream 持有自己的那一份"""
+    version: str
+    system_prompt: str
+    mcp_servers: list
+    loaded_at: float
+
+class ConfigRegistry:
+    """system_prompt.md 與 mcp_servers.json 的 lazy 載入與 hot reload
+
+    第一次 snapshot() 才讀檔；之後最多每 poll_interval 秒 stat 一次，
+    mtime 或大小改變就重新讀取並整份替換 snapshot。版本號是內容的 hash，
+    同樣的檔案在不同 worker 會得到相同版本。讀檔或解析失敗時保留舊版本。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stamps = None
+        self._last_check = 0.0
+        # 第一次 snapshot() 才解析，之後不再每個請求都讀環境變數
+        self._poll_interval = None
+
+    def snapshot(self) -> ConfigSnapshot:
+        current = self._snapshot
+        interval = self._poll_interval
+        if interval is None:
+            interval = self._poll_interval = settings.config_poll_interval
+        if current is not None and time.monotonic() - self._last_check < interval:
+            return current
+        return self._refresh()
+
+    def reload(self) -> ConfigSnapshot:
+        """強制重新讀檔（不看 mtime）"""
+        return self._refresh(force=True)
+
+    def _file_stamps(self):
+        stamps = []
+        for path in (settings.system_prompt_path, settings.mcp_servers_path):
+            try:
+                st = os.stat(path)
+                stamps.append((path, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append((path, None, None))
+        return tuple(stamps)
+
+    def _refresh(self, force: bool = False) -> ConfigSnapshot:
+        with self._lock:
+            self._last_check = time.monotonic()
+            stamps = self._file_stamps()
+            if not force and self._snapshot is not None and stamps == self._stamps:
+                return self._snapshot
+            try:
+                snapshot = self._load()
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                # 記下 stamps，檔案再次變更前不重複嘗試
+                self._stamps = stamps
+                logger.error(f"[CONFIG] 重新載入設定失敗，沿用版本 {self._snapshot.version}: {e}")
+                return self._snapshot
+            if self._snapshot is None or snapshot.version != self._snapshot.version:
+                logger.info(f"[CONFIG] 載入設定版本 {snapshot.version}")
+            self._stamps = stamps
+            # 單一 reference 指派，讀取端不會看到一半新一半舊的設定
+            self._snapshot = snapshot
+            return snapshot
+
+    def _load(self) -> ConfigSnapshot:
+        prompt_path = settings.system_prompt_path
+        if os.path.exists(prompt_path):
+            with open(prompt_path, "r", encoding="utf-8") as f:
+                system_prompt = f.read()
+        else:
+            system_prompt = settings.default_system_prompt
+
+        mcp_path = settings.mcp_servers_path
+        if os.path.exists(mcp_path):
+            with open(mcp_path, "r", encoding="utf-8") as f:
+                mcp_raw = f.read()
+            mcp_servers = json.loads(mcp_raw)
+            _validate_mcp_servers(mcp_servers)
+        else:
+            mcp_raw = ""
+            mcp_servers = []
+
+        digest = hashlib.sha256()
+        digest.update(system_prompt.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(mcp_raw.encode("utf-8"))
+        return ConfigSnapshot(
+            version=digest.hexdigest()[:12],
+            system_prompt=system_prompt,
+            mcp_servers=mcp_servers,
+            loaded_at=time.time()
+        )
+
+def _validate_mcp_servers(mcp_servers):
+    """mcp_servers.json 必須是含 name / url 的物件清單，否則不採用這份設定"""
+    if not isinstance(mcp_servers, list):
+        raise ValueError("mcp_servers.json must be a list of server objects")
+    for i, server in enumerate(mcp_servers):
+        if not isinstance(server, dict):
+            raise ValueError(f"mcp_servers.json entry {i} must be an object")
+        for key in ("name", "url"):
+            if not isinstance(server.get(key), str) or not server[key]:
+                raise ValueError(f"mcp_servers.json entry {i} is missing '{key}'")
+
+config_registry = ConfigRegistry()
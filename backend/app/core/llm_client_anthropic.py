@@ -1,55 +1,58 @@
-import os
-from dotenv import load_dotenv
-import anthropic
-import json
-
-load_dotenv()
-
-SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "system_prompt.md")
-with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
-    SYSTEM_PROMPT = f.read()
-
-# 載入 MCP servers 設定
-MCP_SERVERS_PATH = os.path.join(os.path.dirname(__file__), "mcp_servers.json")
-if os.path.exists(MCP_SERVERS_PATH):
-    with open(MCP_SERVERS_PATH, "r", encoding="utf-8") as f:
-        MCP_SERVERS = json.load(f)
-else:
-    MCP_SERVERS = []
-
-def safe_serialize(obj, debug=False):
-    """安全地序列化物件，處理 Anthropic SDK 的特殊物件"""
-    if debug:
-        print(f"Serializing object of type: {type(obj)}")
-        if hasattr(obj, '__dict__'):
-            print(f"Object attributes: {list(obj.__dict__.keys())}")
-    
-    if obj is None:
+from config import settings, config_registry
+import socket
+from core.stream_events import TextDelta, ToolUse, ToolResult, Usage, to_jsonable
+
+def _abort_stream(stream):
+    """從另一個 thread 中斷正在讀取的 stream
+
+    httpx 的 response.close() 不會喚醒阻塞在 recv 的 thread（連線也不會真的斷），
+    因此先對底層 socket 做 shutdown；取不到 socket 時才退回 close()。
+    """
+    response = getattr(stream, 'response', None)
+    network_stream = response.extensions.get("network_stream") if response is not None else None
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is None:
+        stream.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # 連線已經關閉
+        pass
+
+def _stop_reason(stream):
+    """SDK 累積的 message snapshot 的 stop_reason；尚未收到 message_start 時為 None"""
+    try:
+        return getattr(stream.current_message_snapshot, 'stop_reason', None)
+    except Exception:
         return None
-    elif isinstance(obj, (str, int, float, bool)):
-        return obj
-    elif isinstance(obj, (list, tuple)):
-        return [safe_serialize(item, debug) for item in obj]
-    elif isinstance(obj, dict):
-        return {k: safe_serialize(v, debug) for k, v in obj.items()}
-    elif hasattr(obj, 'model_dump'):
-        # Pydantic 模型
-        return safe_serialize(obj.model_dump(), debug)
-    elif hasattr(obj, '__dict__'):
-        # 其他物件，轉換為字典
-        return safe_serialize(obj.__dict__, debug)
-    else:
-        # 無法序列化的物件，轉為字串
-        return str(obj)
 
 class LLMClient:
     def __init__(self, api_key: str = None, model: str = "claude-sonnet-4-20250514"):
-        self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY", "")
+        self._api_key = api_key
         self.model = model
-        self.client = anthropic.Anthropic(api_key=self.api_key)
-        self.mcp_servers = MCP_SERVERS
+        self.max_tokens = 1024
+        self._client = None
+
+    @property
+    def api_key(self) -> str:
+        return self._api_key or settings.anthropic_api_key
+
+    @property
+    def client(self):
+        # anthropic SDK import 成本高，延後到第一次呼叫 API
+        if self._client is None:
+            import anthropic
+            self._client = anthropic.Anthropic(api_key=self.api_key)
+        return self._client
+
+    @property
+    def mcp_servers(self) -> list:
+        return config_registry.snapshot().mcp_servers
 
     def chat(self, messages: list, model: str = None, mcp_servers: list = None) -> dict:
+        # 整個請求使用同一份設定 snapshot
+        config = config_registry.snapshot()
         # Build messages for Anthropic API
         system_prompt = None
         anthropic_messages = []
@@ -59,11 +62,11 @@ class LLMClient:
             elif m["role"] in ("user", "assistant"):
                 anthropic_messages.append({"role": m["role"], "content": m["content"]})
         if not system_prompt:
-            system_prompt = SYSTEM_PROMPT
+            system_prompt = config.system_prompt
         model_name = model or self.model
         api_kwargs = dict(
             model=model_name,
-            max_tokens=1024,
+            max_tokens=self.max_tokens,
             temperature=0.7,
             messages=anthropic_messages
         )
@@ -71,7 +74,7 @@ class LLMClient:
             api_kwargs["system"] = system_prompt
         
         # 加入 MCP Connector 支援
-        servers_to_use = mcp_servers or self.mcp_servers
+        servers_to_use = mcp_servers or config.mcp_servers
         if servers_to_use:
             api_kwargs.update({
                 "mcp_servers": servers_to_use,
@@ -90,12 +93,12 @@ class LLMClient:
                 if block.type == "text":
                     content += block.text
                 elif block.type == "mcp_tool_use":
-                    tool_calls.append({
-                        "type": "mcp_tool_use",
-                        "name": safe_serialize(getattr(block, 'name', '')),
-                        "server_name": safe_serialize(getattr(block, 'server_name', '')),
-                        "input": safe_serialize(getattr(block, 'input', {}))
-                    })
+                    tool_use = ToolUse(
+                        getattr(block, 'name', ''),
+                        getattr(block, 'server_name', ''),
+                        getattr(block, 'input', {})
+                    )
+                    tool_calls.append(tool_use.content_block())
                 elif block.type == "mcp_tool_result":
                     # 工具結果通常會包含在內容中，這裡記錄但不改變主要回應
                     pass
@@ -107,11 +110,21 @@ class LLMClient:
             "tool_calls": tool_calls,
             "prompt_tokens": usage.input_tokens if usage else None,
             "completion_tokens": usage.output_tokens if usage else None,
-            "total_tokens": (usage.input_tokens + usage.output_tokens) if usage else None
+            "total_tokens": (usage.input_tokens + usage.output_tokens) if usage else None,
+            "cache_creation_input_tokens": getattr(usage, 'cache_creation_input_tokens', None),
+            "cache_read_input_tokens": getattr(usage, 'cache_read_input_tokens', None),
+            "config_version": config.version
         }
 
-    def chat_stream(self, messages: list, model: str = None, mcp_servers: list = None):
-        """Streaming chat response with MCP Connector support"""
+    def chat_stream(self, messages: list, model: str = None, mcp_servers: list = None, cancel_event=None):
+        """Streaming chat response with MCP Connector support
+
+        產生 core.stream_events 的 TextDelta / ToolUse / ToolResult 事件，最後一律送出一個 Usage。
+        cancel_event（core.stream_control.CancelSignal）被設定時會直接關閉上游連線，
+        讓 Anthropic 停止生成。
+        """
+        # 整個 stream 使用同一份設定 snapshot，hot reload 不影響進行中的回應
+        config = config_registry.snapshot()
         # 建構訊息（與 chat() 相同邏輯）
         system_prompt = None
         anthropic_messages = []
@@ -122,48 +135,66 @@ class LLMClient:
                 anthropic_messages.append({"role": m["role"], "content": m["content"]})
         
         if not system_prompt:
-            system_prompt = SYSTEM_PROMPT
+            system_prompt = config.system_prompt
         
         model_name = model or self.model
         
         # 支援 MCP + Streaming
-        servers_to_use = mcp_servers or self.mcp_servers
+        servers_to_use = mcp_servers or config.mcp_servers
         
         stream_kwargs = dict(
             model=model_name,
-            max_tokens=1024,
+            max_tokens=self.max_tokens,
             temperature=0.7,
             messages=anthropic_messages
         )
         if system_prompt:
             stream_kwargs["system"] = system_prompt
         
+        cancelled = False
+        generated_text = ""
+        if cancel_event is not None and cancel_event.is_set():
+            # 尚未開始就被取消，不必建立上游連線
+            yield self._usage_event(None, generated_text, True, config.version)
+            return
+
         if servers_to_use:
             # 使用 MCP Connector + Streaming
             stream_kwargs.update({
                 "mcp_servers": servers_to_use,
                 "betas": ["mcp-client-2025-04-04"]
             })
-            with self.client.beta.messages.stream(**stream_kwargs) as stream:
+            stream_manager = self.client.beta.messages.stream(**stream_kwargs)
+        else:
+            # 原本的純 streaming 邏輯（無 MCP）
+            stream_manager = self.client.messages.stream(**stream_kwargs)
+
+        with stream_manager as stream:
+            closer = lambda: _abort_stream(stream)
+            if cancel_event is not None:
+                # 取消時由 cancel_event.set() 直接中斷上游連線，迴圈內的檢查只是保險
+                cancel_event.add_closer(closer)
+            try:
                 for event in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        # 離開 with 區塊會關閉 HTTP 連線，上游隨即停止生成與計費
+                        cancelled = True
+                        break
                     # 處理文字增量
                     if event.type == "content_block_delta":
                         if hasattr(event.delta, 'text'):
-                            yield {
-                                "type": "text",
-                                "content": event.delta.text
-                            }
+                            generated_text += event.delta.text
+                            yield TextDelta(event.delta.text)
                     # 處理 content block 開始事件
                     elif event.type == "content_block_start":
                         if hasattr(event.content_block, 'type'):
                             # 處理 MCP 工具使用
                             if event.content_block.type == "mcp_tool_use":
-                                yield {
-                                    "type": "mcp_tool_use",
-                                    "name": safe_serialize(getattr(event.content_block, 'name', '')),
-                                    "server_name": safe_serialize(getattr(event.content_block, 'server_name', '')),
-                                    "input": safe_serialize(getattr(event.content_block, 'input', {}))
-                                }
+                                yield ToolUse(
+                                    getattr(event.content_block, 'name', ''),
+                                    getattr(event.content_block, 'server_name', ''),
+                                    getattr(event.content_block, 'input', {})
+                                )
                     # 處理 content block 停止事件
                     elif event.type == "content_block_stop":
                         if hasattr(event, 'content_block') and hasattr(event.content_block, 'type'):
@@ -172,7 +203,7 @@ class LLMClient:
                                 # 安全地處理 content 列表
                                 content_items = getattr(event.content_block, 'content', [])
                                 processed_content = ""
-                                
+                            
                                 if isinstance(content_items, list):
                                     for item in content_items:
                                         if hasattr(item, 'text'):
@@ -180,17 +211,55 @@ class LLMClient:
                                         elif hasattr(item, 'type') and item.type == 'text':
                                             processed_content += str(getattr(item, 'text', ''))
                                         else:
-                                            processed_content += str(safe_serialize(item))
+                                            processed_content += str(to_jsonable(item))
                                 else:
-                                    processed_content = str(safe_serialize(content_items))
-                                    
-                                yield {
-                                    "type": "mcp_tool_result",
-                                    "content": processed_content,
-                                    "is_error": getattr(event.content_block, 'is_error', False)
-                                }
-        else:
-            # 原本的純 streaming 邏輯（無 MCP）
-            with self.client.messages.stream(**stream_kwargs) as stream:
-                for text in stream.text_stream:
-                    yield {"type": "text", "content": text}
+                                    processed_content = str(to_jsonable(content_items))
+                                
+                                yield ToolResult(processed_content, getattr(event.content_block, 'is_error', False))
+            except Exception:
+                # 連線被 cancel 關閉時 SDK 會丟出讀取錯誤，視為取消
+                if cancel_event is None or not cancel_event.is_set():
+                    raise
+                cancelled = True
+            finally:
+                if cancel_event is not None:
+                    cancel_event.remove_closer(closer)
+            if cancel_event is not None and cancel_event.is_set():
+                # socket 被 shutdown 後 SDK 也可能把它當成 stream 正常結束；
+                # 反過來，已收到 stop_reason 的回應是完整的，即使之後才取消也不算取消
+                cancelled = _stop_reason(stream) is None
+            usage_event = self._usage_event(stream, generated_text, cancelled, config.version)
+
+        yield usage_event
+
+    def _usage_event(self, stream, generated_text: str, cancelled: bool, config_version: str) -> Usage:
+        """從 SDK 累積的 message snapshot 取得實際 usage
+
+        input token 於 message_start 即已確定；output token 只在 message_delta 更新，
+        取消時可能尚未收到，因此以已生成文字粗估作為下限。
+        """
+        usage = None
+        stop_reason = None
+        try:
+            snapshot = stream.current_message_snapshot if stream is not None else None
+            usage = getattr(snapshot, 'usage', None)
+            stop_reason = getattr(snapshot, 'stop_reason', None)
+        except Exception:
+            # 尚未收到 message_start 就被取消
+            pass
+
+        prompt_tokens = getattr(usage, 'input_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'output_tokens', 0) or 0
+        if cancelled:
+            completion_tokens = max(completion_tokens, len(generated_text) // 4)
+            stop_reason = "cancelled"
+        return Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cache_creation_input_tokens=getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+            cache_read_input_tokens=getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            stop_reason=stop_reason,
+            cancelled=cancelled,
+            max_tokens=self.max_tokens,
+            config_version=config_version
+        )
@@ -0,0 +1,105 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CancelSignal:
+    """取消訊號；除了 is_set() 供迴圈檢查外，也持有上游 stream 的 close callback
+
+    set() 會立刻呼叫這些 callback 關閉 HTTP 連線，不必等 SDK 送出下一個事件。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._closers = []
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            closers = list(self._closers)
+        for closer in closers:
+            try:
+                closer()
+            except Exception as e:
+                logger.error(f"[STREAM_CONTROL] 關閉上游 stream 失敗: {e}")
+
+    def add_closer(self, closer):
+        """登記上游 stream 的 close；若已取消則立即關閉"""
+        with self._lock:
+            if not self._event.is_set():
+                self._closers.append(closer)
+                return
+        closer()
+
+    def remove_closer(self, closer):
+        with self._lock:
+            if closer in self._closers:
+                self._closers.remove(closer)
+
+class StreamControl:
+    """追蹤進行中的 streaming 請求，提供取消訊號與取消相關的統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._metrics = {
+            "cancelled_streams": 0,
+            "cancelled_by_user": 0,
+            "cancelled_by_disconnect": 0,
+            "cancelled_completion_tokens": 0,
+            "max_tokens_saved_upper_bound": 0,
+        }
+
+    def register(self, session_id: str) -> CancelSignal:
+        """為 session 建立新的取消訊號；同一 session 的新 stream 會取代舊的登記"""
+        cancel_event = CancelSignal()
+        with self._lock:
+            self._active[session_id] = cancel_event
+        return cancel_event
+
+    def unregister(self, session_id: str, cancel_event: CancelSignal):
+        with self._lock:
+            # 只移除自己登記的那一個，避免誤刪同 session 後來的 stream
+            if self._active.get(session_id) is cancel_event:
+                del self._active[session_id]
+
+    def cancel(self, session_id: str) -> bool:
+        with self._lock:
+            cancel_event = self._active.get(session_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        logger.info(f"[STREAM_CONTROL] 取消 stream: session_id={session_id}")
+        return True
+
+    def is_active(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._active
+
+    def record_cancellation(self, reason: str, completion_tokens: int, max_tokens: int):
+        """記錄一次取消
+
+        實際省下多少 token 無從得知（回應可能本來就會很快結束），
+        這裡只累計上限：max_tokens 扣掉已生成的 token。
+        """
+        with self._lock:
+            self._metrics["cancelled_streams"] += 1
+            key = "cancelled_by_disconnect" if reason == "disconnect" else "cancelled_by_user"
+            self._metrics[key] += 1
+            self._metrics["cancelled_completion_tokens"] += completion_tokens
+            self._metrics["max_tokens_saved_upper_bound"] += max(max_tokens - completion_tokens, 0)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(
+                self._metrics,
+                active_streams=len(self._active),
+                note="max_tokens_saved_upper_bound assumes every cancelled reply would have run to max_tokens; "
+                     "cancelled_completion_tokens is the measured output of cancelled streams"
+            )
+
+stream_control = StreamControl()
@@ -0,0 +1,158 @@
+"""LLMClient.chat_stream 送出的事件型別與 SSE 序列化
+
+事件在 LLMClient 建立時就把 SDK 物件轉成 JSON 相容的值（to_jsonable），
+之後 API 層只需 encode_event 一次，不再重複走訪同一份 payload。
+"""
+from abc import ABC, abstractmethod
+import json
+
+def _identity(obj):
+    return obj
+
+def _encode_list(obj):
+    return [to_jsonable(item) for item in obj]
+
+def _encode_dict(obj):
+    return {k: to_jsonable(v) for k, v in obj.items()}
+
+def _encode_model(obj):
+    # Pydantic 模型（Anthropic SDK 的 block 物件）；mode="json" 已是 JSON 相容的值
+    return obj.model_dump(mode="json")
+
+def _encode_object(obj):
+    return to_jsonable(obj.__dict__)
+
+# type -> encoder；第一次遇到某個型別時決定 encoder 並快取，之後不必再跑 isinstance / hasattr
+_ENCODERS = {
+    type(None): _identity,
+    str: _identity,
+    int: _identity,
+    float: _identity,
+    bool: _identity,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+}
+
+def _resolve_encoder(obj):
+    cls = type(obj)
+    if issubclass(cls, (str, int, float, bool)):
+        return _identity
+    if issubclass(cls, (list, tuple)):
+        return _encode_list
+    if issubclass(cls, dict):
+        return _encode_dict
+    if hasattr(obj, 'model_dump'):
+        return _encode_model
+    if hasattr(obj, '__dict__'):
+        # 其他物件，轉換為字典
+        return _encode_object
+    # 無法序列化的物件，轉為字串
+    return str
+
+def to_jsonable(obj):
+    """把 Anthropic SDK 物件轉成 json.dumps 可處理的值（取代舊的 safe_serialize）"""
+    cls = type(obj)
+    encoder = _ENCODERS.get(cls)
+    if encoder is None:
+        encoder = _ENCODERS[cls] = _resolve_encoder(obj)
+    return encoder(obj)
+
+class StreamEvent(ABC):
+    __slots__ = ()
+    # LLMClient 內部的事件型別
+    type = ""
+    # 送給前端的 SSE 事件型別
+    sse_type = ""
+
+    @abstractmethod
+    def to_dict(self) -> dict:
+        """送給前端的 SSE payload（不含 session_id / model 等標記）"""
+
+class TextDelta(StreamEvent):
+    __slots__ = ("content",)
+    type = "text"
+    sse_type = "chunk"
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def to_dict(self) -> dict:
+        return {"type": self.sse_type, "content": self.content}
+
+class ToolUse(StreamEvent):
+    __slots__ = ("name", "server_name", "input")
+    type = "mcp_tool_use"
+    sse_type = "tool_use"
+
+    def __init__(self, name, server_name, input):
+        self.name = to_jsonable(name)
+        self.server_name = to_jsonable(server_name)
+        self.input = to_jsonable(input)
+
+    def to_dict(self) -> dict:
+        return {"type": self.sse_type, "name": self.name, "server_name": self.server_name, "input": self.input}
+
+    def tool_call(self) -> dict:
+        """stream 路徑存進 Message.tool_calls_json 的格式"""
+        return {"name": self.name, "input": self.input}
+
+    def content_block(self) -> dict:
+        """同步 /chat 回傳並存進 Message.tool_calls_json 的格式（Anthropic content block）"""
+        return {"type": self.type, "name": self.name, "server_name": self.server_name, "input": self.input}
+
+class ToolResult(StreamEvent):
+    __slots__ = ("content", "is_error")
+    type = "mcp_tool_result"
+    sse_type = "tool_result"
+
+    def __init__(self, content: str, is_error: bool = False):
+        self.content = content
+        self.is_error = bool(is_error)
+
+    def to_dict(self) -> dict:
+        return {"type": self.sse_type, "content": self.content, "is_error": self.is_error}
+
+class Usage(StreamEvent):
+    __slots__ = (
+        "prompt_tokens",
+        "completion_tokens",
+        "total_tokens",
+        "cache_creation_input_tokens",
+        "cache_read_input_tokens",
+        "stop_reason",
+        "cancelled",
+        "max_tokens",
+        "config_version",
+    )
+    type = "usage"
+    sse_type = "usage"
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0,
+                 cache_creation_input_tokens: int = 0, cache_read_input_tokens: int = 0,
+                 stop_reason: str = None, cancelled: bool = False, max_tokens: int = None,
+                 config_version: str = None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.cache_creation_input_tokens = cache_creation_input_tokens
+        self.cache_read_input_tokens = cache_read_input_tokens
+        self.stop_reason = stop_reason
+        self.cancelled = cancelled
+        self.max_tokens = max_tokens
+        self.config_version = config_version
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["type"] = self.sse_type
+        return data
+
+def sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+def encode_event(event: StreamEvent, **tags) -> str:
+    """把事件加上 session_id / model 等標記後序列化成一則 SSE 訊息"""
+    payload = event.to_dict()
+    if tags:
+        payload.update(tags)
+    return sse(payload)
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel
+from sqlalchemy import inspect, text
 import logging
 import sys
 import os
@@ -8,11 +9,11 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
     # Try relative import first
-    from .models import Session, Message, UserStats
+    from .models import Session, Message, ModelComparison, UserStats, UsageRollup
     from .engine import engine
 except ImportError:
     # Fall back to absolute import when run as script
-    from db.models import Session, Message, UserStats
+    from db.models import Session, Message, ModelComparison, UserStats, UsageRollup
     from db.engine import engine
 
 logging.basicConfig(level=logging.INFO)
@@ -25,10 +26,30 @@ def init_db():
     try:
         logger.info("Creating database tables...")
         SQLModel.metadata.create_all(engine)
+        add_missing_columns()
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.error(f"Failed to create database tables: {e}")
         raise
 
+def add_missing_columns():
+    """create_all 不會修改既有資料表，這裡補上 model 新增的欄位"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    ddl += f" DEFAULT {default!r}"
+                logger.info(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(ddl))
+
 if __name__ == "__main__":
     init_db()
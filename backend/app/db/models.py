@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import UniqueConstraint
 from typing import Optional
 import datetime
 from uuid import uuid4
@@ -21,6 +22,33 @@ class Message(SQLModel, table=True):
     prompt_tokens: Optional[int] = None
     completion_tokens: Optional[int] = None
     total_tokens: Optional[int] = None
+    cache_creation_input_tokens: Optional[int] = None
+    cache_read_input_tokens: Optional[int] = None
+    model: Optional[str] = None
+    # completed / cancelled
+    status: str = "completed"
+    # 產生此回應時的 prompt / MCP 設定版本
+    config_version: Optional[str] = None
+
+class ModelComparison(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(foreign_key="session.session_id")
+    # 同一次 /chat/compare 的各模型結果共用 run_id；prompt 只存在這裡，不進對話歷史
+    run_id: str = Field(index=True)
+    prompt: str
+    model: str
+    content: str
+    timestamp_ms: int
+    ttft_ms: Optional[int] = None
+    latency_ms: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    cache_creation_input_tokens: Optional[int] = None
+    cache_read_input_tokens: Optional[int] = None
+    # completed / cancelled / error
+    status: str = "completed"
+    config_version: Optional[str] = None
 
 class UserStats(SQLModel, table=True):
     id: int = Field(default=1, primary_key=True)
@@ -30,3 +58,17 @@ class UserStats(SQLModel, table=True):
     deleted_prompt_tokens: int = 0
     deleted_completion_tokens: int = 0
     deleted_total_tokens: int = 0
+
+class UsageRollup(SQLModel, table=True):
+    """每日 x 模型 x session 的 token 用量，儲存訊息時增量更新"""
+    __table_args__ = (UniqueConstraint("day", "model", "session_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: str = Field(index=True)  # UTC, YYYY-MM-DD
+    model: str
+    session_id: str
+    message_count: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
@@ -0,0 +1,85 @@
+from sqlmodel import Session as DBSession, select, delete
+from sqlalchemy.dialects.sqlite import insert
+import datetime
+import logging
+import sys
+import os
+
+# Add the parent directory to the path so we can import models
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    # Try relative import first
+    from .models import Message, ModelComparison, UsageRollup
+    from .engine import engine
+    from .init_db import init_db
+except ImportError:
+    # Fall back to absolute import when run as script
+    from db.models import Message, ModelComparison, UsageRollup
+    from db.engine import engine
+    from db.init_db import init_db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UNKNOWN_MODEL = "unknown"
+
+def day_bucket(timestamp_ms: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp_ms / 1000, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+def record_usage(db: DBSession, session_id: str, model: str, timestamp_ms: int, usage: dict, message_count: int = 1):
+    """把一筆訊息的用量累加到 (day, model, session) bucket；由呼叫端 commit
+
+    使用 INSERT ... ON CONFLICT DO UPDATE，多個 worker 同時寫入同一個 bucket 也不會重複建立。
+    """
+    values = {
+        "day": day_bucket(timestamp_ms),
+        "model": model or UNKNOWN_MODEL,
+        "session_id": session_id,
+        "message_count": message_count,
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "total_tokens": usage.get("total_tokens") or 0,
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens") or 0,
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens") or 0,
+    }
+    stmt = insert(UsageRollup).values(**values)
+    table = UsageRollup.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "model", "session_id"],
+        set_={
+            name: table.c[name] + stmt.excluded[name]
+            for name in values
+            if name not in ("day", "model", "session_id")
+        }
+    )
+    db.exec(stmt)
+
+def backfill_usage_rollups():
+    """從既有的 Message 與 ModelComparison 重建 UsageRollup（會先清空）
+
+    與即時累加一致：每筆 assistant 訊息都計入 message_count，用量為 0 也一樣。
+    在第一個 token 前就取消的回應不會存成 Message，它們的 prompt token 只在即時累加中，重建時無法還原。
+    """
+    logger.info("Backfilling usage rollups...")
+    init_db()
+    with DBSession(engine) as db:
+        db.exec(delete(UsageRollup))
+        count = 0
+        rows = list(db.exec(select(Message).where(Message.role == "assistant")).all())
+        rows += db.exec(select(ModelComparison)).all()
+        for row in rows:
+            record_usage(db, row.session_id, row.model, row.timestamp_ms, {
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "total_tokens": row.total_tokens,
+                "cache_creation_input_tokens": row.cache_creation_input_tokens,
+                "cache_read_input_tokens": row.cache_read_input_tokens,
+            })
+            count += 1
+        db.commit()
+    logger.info(f"Usage rollups backfilled from {count} rows")
+    return count
+
+if __name__ == "__main__":
+    backfill_usage_rollups()
@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from api.sessions import router as sessions_router
 from api.chat import router as chat_router
 from api.mcp import router as mcp_router
+from api.config import router as config_router
+from api.stats import router as stats_router
 import logging
 
 # Configure logging
@@ -35,6 +37,8 @@ def startup_event():
 app.include_router(sessions_router)
 app.include_router(chat_router)
 app.include_router(mcp_router)
+app.include_router(config_router)
+app.include_router(stats_router)
 
 @app.get("/health")
 def health():
@@ -1,15 +1,14 @@
-import os
-import requests
-
-MCP_BASE_URL = os.getenv("MCP_BASE_URL", "")
+from config import settings
 
 class CalendarClient:
     def list_gcal_events(self, payload: dict) -> dict:
-        url = f"{MCP_BASE_URL}/mcp/calendar/list_gcal_events"
+        url = f"{settings.mcp_base_url}/mcp/calendar/list_gcal_events"
+        import requests  # 延後 import，縮短 worker 啟動時間
         resp = requests.post(url, json=payload)
         return resp.json()
 
     def create_event(self, payload: dict) -> dict:
-        url = f"{MCP_BASE_URL}/mcp/calendar/create_event"
+        url = f"{settings.mcp_base_url}/mcp/calendar/create_event"
+        import requests
         resp = requests.post(url, json=payload)
         return resp.json()
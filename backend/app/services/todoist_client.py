@@ -1,11 +1,9 @@
-import os
-import requests
-
-MCP_BASE_URL = os.getenv("MCP_BASE_URL", "")
+from config import settings
 
 class TodoistClient:
     def post_sse(self, payload: dict) -> dict:
-        url = f"{MCP_BASE_URL}/mcp/todoist/sse"
+        url = f"{settings.mcp_base_url}/mcp/todoist/sse"
+        import requests  # 延後 import，縮短 worker 啟動時間
         resp = requests.post(url, json=payload)
         return resp.json()
 
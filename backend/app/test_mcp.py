@@ -8,6 +8,7 @@ import os
 sys.path.insert(0, '/app')
 
 from core.llm_client_anthropic import LLMClient
+from core.stream_events import encode_event
 
 def test_mcp_streaming():
     """測試 MCP streaming"""
@@ -21,15 +22,15 @@ def test_mcp_streaming():
     print("Starting stream...")
     try:
         for i, event in enumerate(client.chat_stream(messages)):
-            print(f"Event {i}: type={event['type']}")
+            print(f"Event {i}: type={event.type}")
             
             # 測試序列化
             try:
-                serialized = json.dumps(event)
+                serialized = encode_event(event)
                 print(f"  Successfully serialized: {len(serialized)} chars")
             except Exception as e:
                 print(f"  Serialization error: {e}")
-                print(f"  Event data: {event}")
+                print(f"  Event data: {event.to_dict()}")
                 
             if i > 10:  # 限制事件數量
                 break
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 測試從 backend/app 根目錄 import（與 uvicorn main:app 相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 在 db.engine 被 import 前指向暫存的 SQLite，避免寫到 db/db.sqlite3
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.sqlite3')}"
+
+@pytest.fixture
+def clean_db():
+    """每個測試使用空白的資料表"""
+    from sqlmodel import SQLModel
+    from db.engine import engine
+    from db.init_db import init_db
+
+    engine.echo = False
+    SQLModel.metadata.drop_all(engine)
+    init_db()
+    return engine
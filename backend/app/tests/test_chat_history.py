@@ -0,0 +1,106 @@
+import asyncio
+
+from sqlmodel import Session as DBSession, select
+
+from api import chat
+from core.stream_events import TextDelta, Usage
+from db.models import Message, ModelComparison, UsageRollup
+
+class FakeLLM:
+    max_tokens = 1024
+
+    def __init__(self):
+        self.calls = []
+
+    def chat_stream(self, messages, model=None, cancel_event=None):
+        self.calls.append((model, list(messages)))
+        yield TextDelta(f"answer from {model}")
+        yield Usage(prompt_tokens=5, completion_tokens=2)
+
+def test_compare_prompt_not_in_history(clean_db, monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(chat, "get_llm", lambda: llm)
+    with DBSession(clean_db) as db:
+        db.add(Message(session_id="s1", role="user", content="hello", timestamp_ms=1))
+        db.add(Message(session_id="s1", role="assistant", content="hi", timestamp_ms=2))
+        db.commit()
+
+    async def run():
+        req = chat.CompareRequest(session_id="s1", message="which is better?", models=["a", "b"])
+        return [chunk async for chunk in (await chat.chat_compare_endpoint(req)).body_iterator]
+
+    chunks = asyncio.run(run())
+    assert '"type": "end"' in chunks[-1]
+
+    # 每個模型都看到歷史加上比較的 prompt
+    expected = [
+        {"role": "user", "content": "hello"},
+        {"role": "assistant", "content": "hi"},
+        {"role": "user", "content": "which is better?"},
+    ]
+    assert sorted(llm.calls) == [("a", expected), ("b", expected)]
+
+    with DBSession(clean_db) as db:
+        assert [m.content for m in db.exec(select(Message).order_by(Message.timestamp_ms)).all()] == ["hello", "hi"]
+        rows = db.exec(select(ModelComparison).order_by(ModelComparison.model)).all()
+    assert [(row.model, row.prompt, row.content) for row in rows] == [
+        ("a", "which is better?", "answer from a"),
+        ("b", "which is better?", "answer from b"),
+    ]
+    assert rows[0].run_id == rows[1].run_id
+
+    # 下一輪對話不會帶到沒有回覆的比較 prompt
+    assert chat._load_history("s1", "next", None)[-2:] == [
+        {"role": "assistant", "content": "hi"},
+        {"role": "user", "content": "next"},
+    ]
+
+def test_store_user_message_returns_history_with_prompt(clean_db):
+    with DBSession(clean_db) as db:
+        db.add(Message(session_id="s1", role="user", content="hello", timestamp_ms=1))
+        db.add(Message(session_id="s1", role="assistant", content="hi", timestamp_ms=2))
+        db.commit()
+
+    messages = chat._store_user_message("s1", "next", None)
+    assert messages == [
+        {"role": "user", "content": "hello"},
+        {"role": "assistant", "content": "hi"},
+        {"role": "user", "content": "next"},
+    ]
+    # 帶 history 時不讀資料庫，也不修改呼叫端的 list
+    history = [{"role": "user", "content": "x"}]
+    assert chat._store_user_message("s1", "more", history)[-1] == {"role": "user", "content": "more"}
+    assert history == [{"role": "user", "content": "x"}]
+
+    with DBSession(clean_db) as db:
+        stored = db.exec(select(Message).order_by(Message.timestamp_ms, Message.id)).all()
+    assert [m.content for m in stored] == ["hello", "hi", "next", "more"]
+
+def test_early_cancel_is_not_stored_in_history(clean_db):
+    with DBSession(clean_db) as db:
+        db.add(Message(session_id="s1", role="user", content="hello", timestamp_ms=1))
+        # 舊版存下的空白取消回應
+        db.add(Message(session_id="s1", role="assistant", content="", timestamp_ms=2, status="cancelled"))
+        db.commit()
+
+    messages = chat._store_user_message("s1", "stop early", None)
+    assert messages == [{"role": "user", "content": "hello"}, {"role": "user", "content": "stop early"}]
+
+    upstream = chat.UpstreamStream(iter([Usage(prompt_tokens=8, cancelled=True)]))
+    upstream.drain()
+    message_id, collected = chat._finish_stream("s1", "model-a", upstream, "user")
+    assert message_id is None
+    assert collected["prompt"] == 8
+
+    with DBSession(clean_db) as db:
+        stored = db.exec(select(Message).order_by(Message.timestamp_ms, Message.id)).all()
+        assert [(m.role, m.content) for m in stored] == [("user", "hello"), ("assistant", ""), ("user", "stop early")]
+        rollup, = db.exec(select(UsageRollup)).all()
+    # 用量照常累加，但沒有存下訊息
+    assert (rollup.message_count, rollup.prompt_tokens) == (0, 8)
+
+    assert chat._load_history("s1", "again", None) == [
+        {"role": "user", "content": "hello"},
+        {"role": "user", "content": "stop early"},
+        {"role": "user", "content": "again"},
+    ]
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from config import DEFAULT_CONFIG_POLL_INTERVAL, ConfigRegistry, settings
+
+SERVERS = [{"type": "url", "name": "todoist", "url": "https://example.com/sse"}]
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    prompt = tmp_path / "system_prompt.md"
+    servers = tmp_path / "mcp_servers.json"
+    prompt.write_text("v1", encoding="utf-8")
+    servers.write_text(json.dumps(SERVERS), encoding="utf-8")
+    monkeypatch.setenv("SYSTEM_PROMPT_PATH", str(prompt))
+    monkeypatch.setenv("MCP_SERVERS_PATH", str(servers))
+    monkeypatch.setenv("CONFIG_POLL_INTERVAL", "0")
+    return prompt, servers
+
+def test_loads_lazily_and_hot_reloads(files):
+    prompt, _ = files
+    registry = ConfigRegistry()
+    assert registry._snapshot is None
+
+    first = registry.snapshot()
+    assert first.system_prompt == "v1"
+    assert first.mcp_servers == SERVERS
+
+    prompt.write_text("v2 - longer", encoding="utf-8")
+    second = registry.snapshot()
+    assert second.system_prompt == "v2 - longer"
+    assert second.version != first.version
+    # 舊 snapshot 不受影響（進行中的 stream 持有它）
+    assert first.system_prompt == "v1"
+
+def test_version_depends_only_on_content(files):
+    assert ConfigRegistry().snapshot().version == ConfigRegistry().snapshot().version
+
+@pytest.mark.parametrize("content", ["{bad", '{"a": 1}', '["x"]', '[{"name": "no-url"}]'])
+def test_invalid_mcp_servers_keeps_previous_snapshot(files, content):
+    _, servers = files
+    registry = ConfigRegistry()
+    good = registry.snapshot()
+
+    servers.write_text(content, encoding="utf-8")
+    assert registry.snapshot() is good
+    assert registry.reload() is good
+
+def test_invalid_mcp_servers_on_first_load_raises(files):
+    _, servers = files
+    servers.write_text('{"a": 1}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        ConfigRegistry().snapshot()
+
+def test_database_url_from_settings(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("DOCKER_ENV", "1")
+    assert settings.database_url == "sqlite:////app/db/db.sqlite3"
+    monkeypatch.delenv("DOCKER_ENV")
+    assert settings.database_url.endswith("db/db.sqlite3")
+
+def test_invalid_poll_interval_falls_back_to_default(files, monkeypatch, caplog):
+    prompt, _ = files
+    monkeypatch.setenv("CONFIG_POLL_INTERVAL", "soon")
+    registry = ConfigRegistry()
+    first = registry.snapshot()
+    assert registry._poll_interval == DEFAULT_CONFIG_POLL_INTERVAL
+    assert "CONFIG_POLL_INTERVAL" in caplog.text
+
+    # 只解析一次：預設間隔內不重新讀檔
+    prompt.write_text("v2", encoding="utf-8")
+    assert registry.snapshot() is first
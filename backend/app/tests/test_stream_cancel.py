@@ -0,0 +1,148 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anthropic
+import pytest
+
+from config import config_registry
+from core.llm_client_anthropic import LLMClient
+from core.stream_control import StreamControl
+from core.stream_events import TextDelta, Usage
+
+PAUSE = 4.0
+
+def _sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(dict(data, type=event_type))}\n\n".encode()
+
+class SlowAnthropicHandler(BaseHTTPRequestHandler):
+    """送出第一段文字後停 PAUSE 秒，模擬上游在工具呼叫期間沒有任何事件
+
+    STOP_BEFORE_PAUSE 時先送出 message_delta（stop_reason），模擬回應已完整生成、只差 message_stop。
+    """
+    STOP_BEFORE_PAUSE = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(_sse("message_start", {"message": {
+            "id": "msg_1", "type": "message", "role": "assistant", "content": [], "model": "test",
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 10, "output_tokens": 1}
+        }}))
+        self.wfile.write(_sse("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}))
+        self.wfile.write(_sse("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": "hello"}}))
+        if self.STOP_BEFORE_PAUSE:
+            self.wfile.write(_sse("content_block_stop", {"index": 0}))
+            self.wfile.write(_sse("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                                    "usage": {"output_tokens": 2}}))
+        self.wfile.flush()
+        time.sleep(PAUSE)
+        try:
+            self.wfile.write(_sse("message_stop", {}))
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def llm(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowAnthropicHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # 不使用 MCP servers
+    monkeypatch.setenv("MCP_SERVERS_PATH", str(tmp_path / "missing.json"))
+    config_registry.reload()
+    client = LLMClient(api_key="test")
+    client._client = anthropic.Anthropic(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}", max_retries=0)
+    yield client
+    server.shutdown()
+    monkeypatch.undo()
+    config_registry.reload()
+
+def test_cancel_closes_upstream_without_waiting_for_next_event(llm):
+    control = StreamControl()
+    cancel_event = control.register("s1")
+    events = llm.chat_stream([{"role": "user", "content": "hi"}], model="test", cancel_event=cancel_event)
+
+    first = next(events)
+    assert isinstance(first, TextDelta)
+
+    threading.Timer(0.2, control.cancel, args=("s1",)).start()
+    started = time.monotonic()
+    rest = list(events)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < PAUSE / 2
+    usage = rest[-1]
+    assert isinstance(usage, Usage)
+    assert usage.cancelled
+    assert usage.prompt_tokens == 10
+
+def test_cancel_after_stop_reason_is_not_a_cancellation(llm, monkeypatch):
+    monkeypatch.setattr(SlowAnthropicHandler, "STOP_BEFORE_PAUSE", True)
+    control = StreamControl()
+    cancel_event = control.register("s1")
+    events = llm.chat_stream([{"role": "user", "content": "hi"}], model="test", cancel_event=cancel_event)
+    assert isinstance(next(events), TextDelta)
+
+    threading.Timer(0.2, control.cancel, args=("s1",)).start()
+    usage = list(events)[-1]
+    assert not usage.cancelled
+    assert usage.stop_reason == "end_turn"
+    assert usage.completion_tokens == 2
+
+def test_cancel_before_start_skips_upstream(llm):
+    control = StreamControl()
+    cancel_event = control.register("s1")
+    cancel_event.set()
+    events = list(llm.chat_stream([{"role": "user", "content": "hi"}], model="test", cancel_event=cancel_event))
+    assert len(events) == 1 and events[0].cancelled
+
+def test_client_disconnect_closes_upstream_without_waiting_for_next_event(llm, monkeypatch):
+    from fastapi import FastAPI
+    from api import chat
+
+    finished = []
+    monkeypatch.setattr(chat, "get_llm", lambda: llm)
+    monkeypatch.setattr(chat, "_store_user_message", lambda *args: [{"role": "user", "content": "hi"}])
+    monkeypatch.setattr(chat, "_finish_stream", lambda *args: finished.append((time.monotonic(), args)))
+    app = FastAPI()
+    app.include_router(chat.router)
+
+    body = json.dumps({"session_id": "s1", "message": "hi", "model": "test"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+        "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+    chunks = []
+    disconnected = []
+
+    async def receive():
+        if not disconnected:
+            disconnected.append(None)
+            return {"type": "http.request", "body": body, "more_body": False}
+        # 收到第一段文字後 client 離開，此時上游正停在 PAUSE 中
+        while not any(b'"chunk"' in chunk for chunk in chunks):
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        disconnected[0] = time.monotonic()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    asyncio.run(app(scope, receive, send))
+
+    assert len(finished) == 1
+    finished_at, (session_id, model, upstream, cancel_reason) = finished[0]
+    assert finished_at - disconnected[0] < PAUSE / 2
+    assert cancel_reason == "disconnect"
+    assert upstream.usage.cancelled
+    assert upstream.content == "hello"
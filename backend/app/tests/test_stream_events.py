@@ -0,0 +1,77 @@
+import datetime
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from core.stream_events import StreamEvent, TextDelta, ToolResult, ToolUse, Usage, encode_event, to_jsonable
+
+class Block(BaseModel):
+    type: str = "text"
+    text: str
+    created: datetime.datetime
+
+class Wrapper(BaseModel):
+    blocks: List[Block]
+
+class Plain:
+    def __init__(self):
+        self.name = "plain"
+        self.items = (1, 2)
+
+def test_to_jsonable():
+    created = datetime.datetime(2025, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    value = {
+        "model": Wrapper(blocks=[Block(text="hi", created=created)]),
+        "tuple": (1, "a", None),
+        "object": Plain(),
+        "other": object(),
+    }
+    result = to_jsonable(value)
+    assert result["model"] == {"blocks": [{"type": "text", "text": "hi", "created": "2025-01-02T03:04:05Z"}]}
+    assert result["tuple"] == [1, "a", None]
+    assert result["object"] == {"name": "plain", "items": [1, 2]}
+    assert isinstance(result["other"], str)
+    json.dumps(result)
+
+def test_to_jsonable_subclasses():
+    class Name(str):
+        pass
+
+    class Items(dict):
+        pass
+
+    assert to_jsonable(Items(a=[Name("x")])) == {"a": ["x"]}
+
+def test_tool_use_formats():
+    event = ToolUse("list_events", "calendar", {"range": ("a", "b")})
+    assert event.to_dict() == {"type": "tool_use", "name": "list_events", "server_name": "calendar", "input": {"range": ["a", "b"]}}
+    assert event.tool_call() == {"name": "list_events", "input": {"range": ["a", "b"]}}
+    assert event.content_block() == {
+        "type": "mcp_tool_use", "name": "list_events", "server_name": "calendar", "input": {"range": ["a", "b"]}
+    }
+
+def _decode(message: str) -> dict:
+    assert message.startswith("data: ") and message.endswith("\n\n")
+    return json.loads(message[len("data: "):])
+
+def test_encode_event():
+    assert _decode(encode_event(TextDelta("hi"), session_id="s1")) == {"type": "chunk", "content": "hi", "session_id": "s1"}
+    assert _decode(encode_event(ToolResult("done", is_error=1), model="m")) == {
+        "type": "tool_result", "content": "done", "is_error": True, "model": "m"
+    }
+    usage = _decode(encode_event(Usage(3, 4, cancelled=True, max_tokens=1024)))
+    assert usage["type"] == "usage"
+    assert usage["total_tokens"] == 7
+    assert usage["cancelled"] is True
+
+def test_stream_event_is_abstract():
+    with pytest.raises(TypeError):
+        StreamEvent()
+
+    class Incomplete(StreamEvent):
+        __slots__ = ()
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from api import chat
+from core.stream_control import stream_control
+from core.stream_events import TextDelta, Usage
+
+class FakeLLM:
+    max_tokens = 1024
+
+    def chat_stream(self, messages, model=None, cancel_event=None):
+        yield TextDelta("hi")
+        yield Usage(prompt_tokens=3, completion_tokens=1, cancelled=cancel_event.is_set())
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(chat, "get_llm", lambda: FakeLLM())
+    monkeypatch.setattr(chat, "_store_user_message", lambda *args: [{"role": "user", "content": "hi"}])
+    monkeypatch.setattr(chat, "_load_history", lambda *args: [{"role": "user", "content": "hi"}])
+    monkeypatch.setattr(chat, "_finish_stream", lambda *args: (1, {"prompt": 3, "completion": 1, "total": 4}))
+    monkeypatch.setattr(chat, "_finish_compare", lambda *args: [])
+
+def _active():
+    return stream_control.metrics()["active_streams"]
+
+@pytest.mark.parametrize("endpoint, req", [
+    (chat.chat_stream_endpoint, chat.ChatRequest(session_id="reg-1", message="hi")),
+    (chat.chat_compare_endpoint, chat.CompareRequest(session_id="reg-1", message="hi", models=["a", "b"])),
+])
+def test_registration_released_in_every_exit_path(endpoint, req):
+    async def scenario():
+        before = _active()
+
+        # client 在 body 開始前離開：generator 從未執行，不應留下登記
+        await endpoint(req)
+        assert _active() == before
+
+        # body 開始後斷線
+        body = (await endpoint(req)).body_iterator
+        await body.__anext__()
+        assert _active() == before + 1
+        await body.aclose()
+        assert _active() == before
+
+        # 正常結束
+        chunks = [chunk async for chunk in (await endpoint(req)).body_iterator]
+        assert '"type": "end"' in chunks[-1]
+        assert _active() == before
+
+    asyncio.run(scenario())
+
+def test_disconnect_after_complete_reply_is_not_cancelled(monkeypatch):
+    finished = []
+    monkeypatch.setattr(chat, "_finish_stream", lambda *args: finished.append(args) or (1, {}))
+
+    async def scenario():
+        req = chat.ChatRequest(session_id="reg-2", message="hi")
+        body = (await chat.chat_stream_endpoint(req)).body_iterator
+        await body.__anext__()
+        await body.__anext__()
+        # 上游已送出完整回應與 usage，client 才離開
+        await asyncio.sleep(0.1)
+        await body.aclose()
+
+    asyncio.run(scenario())
+    (session_id, model, upstream, cancel_reason), = finished
+    assert cancel_reason is None
+    assert upstream.content == "hi"
+
+@pytest.mark.parametrize("models", [[], ["m"] * (chat.MAX_COMPARE_MODELS + 1)])
+def test_compare_model_count_is_limited(models):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.include_router(chat.router)
+    response = TestClient(app).post("/chat/compare", json={"session_id": "s1", "message": "hi", "models": models})
+    assert response.status_code == 422
@@ -0,0 +1,70 @@
+from sqlmodel import Session as DBSession, select
+
+from api import chat
+from api.stats import get_stats
+from core.stream_events import TextDelta, Usage
+from db.models import UsageRollup
+from db.usage_rollup import backfill_usage_rollups, day_bucket, record_usage
+
+def _upstream(*events):
+    upstream = chat.UpstreamStream(iter(events))
+    upstream.drain()
+    return upstream
+
+def _rollups(engine):
+    with DBSession(engine) as db:
+        rows = db.exec(select(UsageRollup).order_by(UsageRollup.day, UsageRollup.model, UsageRollup.session_id)).all()
+        return [row.model_dump(exclude={"id"}) for row in rows]
+
+def test_day_bucket_is_utc():
+    assert day_bucket(0) == "1970-01-01"
+    assert day_bucket(86_400_000 - 1) == "1970-01-01"
+    assert day_bucket(86_400_000) == "1970-01-02"
+
+def test_backfill_matches_incremental_totals(clean_db):
+    chat._finish_stream("s1", "model-a", _upstream(TextDelta("hi"), Usage(10, 5, cache_read_input_tokens=7)), None)
+    chat._finish_stream("s1", "model-a", _upstream(TextDelta("again"), Usage(12, 3)), None)
+    # 用量為 0 的訊息也要計入 message_count
+    chat._finish_stream("s2", "model-b", _upstream(TextDelta("ok"), Usage()), None)
+    chat._finish_compare("s2", "run-1", "compare", {
+        "model-a": _upstream(TextDelta("a"), Usage(4, 2)),
+        "model-b": _upstream(TextDelta("b"), Usage(4, 6)),
+    }, None)
+
+    incremental = _rollups(clean_db)
+    assert sum(row["message_count"] for row in incremental) == 5
+
+    assert backfill_usage_rollups() == 5
+    assert _rollups(clean_db) == incremental
+
+def test_stats_grouping(clean_db):
+    day1 = 1_700_000_000_000
+    day2 = day1 + 86_400_000
+    with DBSession(clean_db) as db:
+        record_usage(db, "s1", "model-a", day1, {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})
+        record_usage(db, "s1", "model-a", day1, {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2})
+        record_usage(db, "s2", "model-b", day1, {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7})
+        record_usage(db, "s1", None, day2, {"prompt_tokens": 2, "completion_tokens": 2, "total_tokens": 4})
+        db.commit()
+    first, second = day_bucket(day1), day_bucket(day2)
+
+    by_day = get_stats(group_by="day")["data"]
+    assert [(row["day"], row["message_count"], row["total_tokens"]) for row in by_day] == [
+        (first, 3, 24), (second, 1, 4)
+    ]
+
+    by_model = get_stats(group_by="model")["data"]
+    assert {row["model"]: row["total_tokens"] for row in by_model} == {"model-a": 17, "model-b": 7, "unknown": 4}
+
+    by_session = get_stats(group_by="session", start=second)["data"]
+    assert [(row["session_id"], row["total_tokens"]) for row in by_session] == [("s1", 4)]
+
+    total = get_stats(group_by="total", model="model-a", end=first)["data"]
+    assert total == [{
+        "message_count": 2,
+        "prompt_tokens": 11,
+        "completion_tokens": 6,
+        "total_tokens": 17,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+    }]